@@ -2,18 +2,35 @@
 # Date = Sunday, December 14, 2025
 # Version = 0.9
 
+import streamlit as st
+
+# --- Health Check ---
+# Answer liveness probes before the heavy imports, logging and page setup below
+if "healthz" in st.query_params:
+    st.write("OK")
+    st.stop()
+
 import os
+import hashlib
+import re
 import logging
-import json
+import threading
+from contextlib import closing
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal, get_args
 import pandas as pd
-import streamlit as st
-import markdown
-from xhtml2pdf import pisa
+from markdown_it import MarkdownIt
+import docx2txt
 from io import BytesIO
-from langchain_community.document_loaders import Docx2txtLoader
+from langchain_community.cache import SQLiteCache
+from langchain_core.globals import set_llm_cache
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.messages import SystemMessage
+from langchain_core.outputs import Generation
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import JsonOutputParser, PydanticOutputParser, StrOutputParser
+from pydantic import BaseModel, ConfigDict, Field, RootModel, ValidationError
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -33,162 +50,511 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# --- LLM Cache Configuration ---
+# Opt-in, since the cache persists prompts (including document text) to disk.
+# LangChain only consults the cache on invoke/batch, so while it is enabled the
+# Gemini calls are made with invoke instead of being streamed.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")
+
+@st.cache_resource
+def get_llm_cache(database_path):
+    """
+    Returns the shared SQLite LLM cache, created once per process.
+    """
+    logger.info(f"LLM response cache enabled at: {database_path}")
+    return SQLiteCache(database_path=database_path)
+
+if LLM_CACHE_PATH:
+    set_llm_cache(get_llm_cache(LLM_CACHE_PATH))
+
+# Columns of the STRIDE risk table, in display order
+RISK_COLUMNS = ["Feature Name", "Threat Type", "Description", "Risk", "Recommendation", "Risk Level"]
+
+# Bounds for the in-memory caches holding document text, so it neither
+# accumulates across users nor outlives a working session
+CACHE_MAX_ENTRIES = 16
+CACHE_TTL_SECONDS = 3600
+
+# Documents longer than this are assessed section by section, in parallel
+SECTION_MAX_CHARS = 12000
+MAX_CONCURRENCY = 8
+
+# --- Data Models ---
+
+ThreatType = Literal[
+    "Spoofing", "Tampering", "Repudiation",
+    "Information Disclosure", "Denial of Service", "Elevation of Privilege",
+]
+RiskLevel = Literal["High", "Medium", "Low"]
+
+class Risk(BaseModel):
+    """
+    A single STRIDE finding. Aliases match the risk table column names.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    feature_name: str = Field(alias="Feature Name")
+    threat_type: ThreatType = Field(alias="Threat Type")
+    description: str = Field(alias="Description")
+    risk: str = Field(alias="Risk")
+    recommendation: str = Field(alias="Recommendation")
+    risk_level: RiskLevel = Field(alias="Risk Level")
+
+class RiskAssessment(RootModel[list[Risk]]):
+    """
+    The full list of STRIDE findings returned by the model.
+    """
+
+# --- Prompts ---
+# Invariant instructions live in byte-identical system messages so Gemini can
+# reuse the cached prefix; the human messages only carry per-request data.
+
+_threat_types = ", ".join(get_args(ThreatType))
+_risk_levels = ", ".join(get_args(RiskLevel))
+
+STRIDE_SYSTEM_PROMPT = f"""You are a Senior Security Engineer applying STRIDE threat modeling to a product requirement document.
+Return only a raw JSON array (no markdown fences), one object per threat, with exactly these keys:
+"Feature Name" (affected feature or component), "Threat Type" ({_threat_types}), "Description", "Risk" (impact), "Recommendation" (mitigation), "Risk Level" ({_risk_levels}).
+
+Example:
+[{{"Feature Name":"Password Reset","Threat Type":"Spoofing","Description":"Reset links never expire.","Risk":"Account takeover through a leaked link.","Recommendation":"Issue single-use tokens that expire within 15 minutes.","Risk Level":"High"}}]"""
+
+RISK_FIX_PROMPT = """This JSON failed schema validation:
+{error}
+
+JSON: {completion}
+
+Return the corrected JSON array with the same findings."""
+
+NARRATIVE_SYSTEM_PROMPT = """You are a Senior Security Engineer writing a formal Security Assessment Report from a system description and its identified STRIDE risks.
+Write these Markdown sections:
+
+# Security Assessment Report
+## Executive Summary
+(system overview and critical findings)
+## Introduction
+(the document and system under review)
+## Scope
+(what was analyzed)
+## Methodology
+(STRIDE threat modeling)
+## Conclusion
+(final thoughts and next steps)
+
+Do NOT include a risk table; it is appended separately."""
+
 # --- Helper Functions ---
 
+@st.cache_resource
+def get_executor():
+    """
+    Returns a process-wide thread pool used to run LLM calls in the background.
+    """
+    return ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource
+def get_pdf_executor():
+    """
+    Returns a small dedicated thread pool for PDF rendering, so renders are
+    never queued behind long-running narrative generation.
+    """
+    return ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource
+def get_markdown():
+    """
+    Returns the shared Markdown renderer for the PDF export, created once per process.
+    Raw HTML is disabled: the report is LLM output and must not inject markup into the PDF.
+    """
+    return MarkdownIt("commonmark", {"html": False}).enable("table")
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+def _md_to_html(md_text):
+    """
+    Converts a Markdown string to HTML. Cached so reruns skip re-parsing the report.
+    """
+    return get_markdown().render(md_text)
+
+def _html_to_pdf(source_html):
+    """
+    Renders an HTML string to PDF bytes. Not cached here: the report page keeps
+    the bytes in session state, so each report is rendered once per session.
+    External resources are never fetched: the report HTML derives from LLM output,
+    which an uploaded document can steer towards file:// or internal URLs.
+    """
+    # Imported here so a host without the Pango libraries only loses PDF export
+    import weasyprint
+    from weasyprint.urls import URLFetcher
+    no_fetch = URLFetcher(allowed_protocols=())
+    return weasyprint.HTML(string=source_html, url_fetcher=no_fetch).write_pdf()
+
+@st.cache_resource
+def get_llm(temperature):
+    """
+    Returns a shared Gemini chat client for the given temperature, so the
+    underlying connection is reused across calls and reruns.
+    """
+    model_name = os.getenv("MODELAI", "gemini-flash-latest")
+    api_key = os.getenv("GOOGLE_API_KEY")
+    logger.info(f"Creating Gemini client (model={model_name}, temperature={temperature})")
+    return ChatGoogleGenerativeAI(model=model_name, temperature=temperature, google_api_key=api_key)
+
+def _risks_to_md(risks):
+    """
+    Renders the risk list as a Markdown table without building a DataFrame.
+    """
+    def cell(value):
+        return str(value).replace("|", "\\|").replace("\n", " ")
+
+    lines = [
+        "| " + " | ".join(RISK_COLUMNS) + " |",
+        "|" + "|".join("---" for _ in RISK_COLUMNS) + "|",
+    ]
+    for risk in risks:
+        lines.append("| " + " | ".join(cell(risk.get(key, "")) for key in RISK_COLUMNS) + " |")
+    return "\n".join(lines)
+
 def convert_to_pdf(source_html):
     """
-    Converts HTML string to PDF bytes using xhtml2pdf.
+    Converts HTML string to PDF bytes using WeasyPrint.
     """
-    result = BytesIO()
-    pisa_status = pisa.CreatePDF(source_html, dest=result)
-    if pisa_status.err:
-        logger.error(f"PDF generation error: {pisa_status.err}")
+    try:
+        return _html_to_pdf(source_html)
+    except Exception as e:
+        logger.error(f"PDF generation error: {e}")
         return None
-    return result.getvalue()
+
+class OrjsonOutputParser(JsonOutputParser):
+    """
+    JsonOutputParser that decodes complete responses with orjson, falling back
+    to the default parser for partial chunks and fenced or malformed output.
+    """
+
+    def parse_result(self, result, *, partial=False):
+        if not partial:
+            try:
+                return orjson.loads(result[0].text.strip())
+            except orjson.JSONDecodeError:
+                pass
+        return super().parse_result(result, partial=partial)
 
 # --- Core Logic ---
 
-def load_docx(uploaded_file):
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+def _extract_docx_bytes(file_bytes):
     """
-    Saves the uploaded file to a temporary directory, loads it using Docx2txtLoader,
-    and returns the content. Cleans up the temporary file afterwards.
+    Extracts the text content of DOCX bytes in memory using docx2txt.
+    Cached on the file bytes so reruns skip parsing.
     """
-    # Ensure temp directory exists
-    os.makedirs("temp", exist_ok=True)
-    temp_path = os.path.join("temp", uploaded_file.name)
-    
-    logger.info(f"Saving uploaded file to temporary path: {temp_path}")
-    
-    # Save to temp
-    with open(temp_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    
     try:
-        # Load
         logger.info("Loading document content...")
-        loader = Docx2txtLoader(temp_path)
-        data = loader.load()
-        content = data[0].page_content # loader.load() returns a list of documents
+        content = docx2txt.process(BytesIO(file_bytes))
         logger.info("Document content loaded successfully.")
     except Exception as e:
         logger.error(f"Error loading document: {e}")
         raise e
-    finally:
-        # Cleanup
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-            logger.info(f"Cleaned up temporary file: {temp_path}")
-            
+    
     return content
 
+def load_docx(uploaded_file):
+    """
+    Returns the text content of the uploaded DOCX file.
+    """
+    logger.info(f"Extracting text from uploaded file: {uploaded_file.name}")
+    return _extract_docx_bytes(uploaded_file.getvalue())
+
+def split_sections(text_content, max_chars=SECTION_MAX_CHARS):
+    """
+    Splits the document into sections of at most max_chars, breaking on
+    paragraph boundaries. Short documents are returned as a single section.
+    """
+    sections = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text_content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            sections.append(current)
+            current = paragraph
+        else:
+            current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        sections.append(current)
+    return sections
+
+def dedupe_risks(section_risks):
+    """
+    Merges the findings of each section, keyed on feature and threat type. A
+    finding is dropped only when a different section already reported the same
+    key, so distinct threats within one section's answer are all kept.
+    """
+    owners = {}
+    merged = []
+    for index, risks in enumerate(section_risks):
+        for risk in risks:
+            key = (risk["Feature Name"].strip().lower(), risk["Threat Type"])
+            if owners.setdefault(key, index) == index:
+                merged.append(risk)
+    return merged
+
 def analyze_risk(text_content):
     """
     Uses Google Gemini to perform a STRIDE-based security risk assessment.
-    Returns a list of dictionaries (JSON).
+    Long documents are split into sections that are assessed concurrently
+    and merged. Returns a list of dictionaries (JSON).
     """
     logger.info("Starting risk assessment analysis...")
     
-    model_name = os.getenv("MODELAI", "gemini-flash-latest")
-    api_key = os.getenv("GOOGLE_API_KEY")
-    
-    if not api_key:
+    if not os.getenv("GOOGLE_API_KEY"):
         logger.error("GOOGLE_API_KEY not found.")
         st.error("Error: GOOGLE_API_KEY not found in environment variables.")
         return []
 
-    llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.3, google_api_key=api_key)
-    
-    # We ask for a strict JSON output
-    template = """
-    You are a Senior Security Engineer. You are analyzing a product requirement document.
-    Apply the STRIDE threat modeling methodology to the following system description.
+    llm = get_llm(0.3)
     
-    Identify potential threats and return the output as a strictly formatted JSON array of objects. 
-    Each object must have the following keys:
-    - "Feature Name": The specific feature or component affected.
-    - "Threat Type": The STRIDE category (Spoofing, Tampering, etc.).
-    - "Description": A description of the threat.
-    - "Risk": The potential impact or consequence.
-    - "Recommendation": Mitigation steps.
-    - "Risk Level": High, Medium, or Low.
-
-    Do not include any markdown formatting (like ```json). Just the raw JSON array.
+    prompt = ChatPromptTemplate.from_messages([
+        SystemMessage(content=STRIDE_SYSTEM_PROMPT),
+        ("human", "System Description: {text}"),
+    ])
+    parser = OrjsonOutputParser()
+    chain = prompt | llm | parser
     
-    System Description: {text}
-    """
+    sections = split_sections(text_content)
+    logger.info(f"Analyzing {len(sections)} document section(s)...")
     
-    prompt = PromptTemplate.from_template(template)
-    chain = prompt | llm | JsonOutputParser()
+    placeholder = st.empty()
+    response = []
     
     try:
-        response = chain.invoke({"text": text_content})
+        if len(sections) == 1:
+            # Parse the text as it grows so the table can be rendered as the objects
+            # arrive. Partial parses treat unparseable text as "nothing yet", so the
+            # complete text is parsed strictly at the end: a non-JSON reply raises
+            # instead of silently producing an empty assessment.
+            text_chain = prompt | llm | StrOutputParser()
+            if LLM_CACHE_PATH:
+                text = text_chain.invoke({"text": sections[0]})
+            else:
+                text = ""
+                shown = None
+                for chunk in text_chain.stream({"text": sections[0]}):
+                    text += chunk
+                    partial = parser.parse_result([Generation(text=text)], partial=True)
+                    if isinstance(partial, list) and partial and partial != shown:
+                        placeholder.dataframe(pd.DataFrame(partial))
+                        shown = partial
+            response = validate_risks(parser.parse(text))
+        else:
+            # Map: assess the sections concurrently, showing each result as it completes
+            inputs = [{"text": section} for section in sections]
+            results = {}
+            for index, result in chain.batch_as_completed(inputs, config={"max_concurrency": MAX_CONCURRENCY}):
+                results[index] = result if isinstance(result, list) else [result]
+                response = [risk for i in sorted(results) for risk in results[i]]
+                placeholder.dataframe(pd.DataFrame(response))
+            
+            # Reduce: validate each section, then drop findings repeated across sections
+            response = dedupe_risks([validate_risks(results[i]) for i in sorted(results)])
+        
         logger.info("Risk assessment analysis completed successfully.")
         return response
     except Exception as e:
         logger.error(f"Error during risk assessment analysis: {e}")
         st.error(f"Error parsing AI response: {e}")
         return []
-def generate_report_narrative(text_content, risks_data):
+    finally:
+        placeholder.empty()
+def validate_risks(risks):
     """
-    Generates the narrative sections of the report (Executive Summary, Intro, etc.).
+    Validates the parsed risks against the Risk schema. If validation fails,
+    asks Gemini once to fix the output instead of making the user re-run the
+    whole assessment. Returns a list of dictionaries keyed by column name.
     """
-    logger.info("Generating report narrative...")
-    
-    model_name = os.getenv("MODELAI", "gemini-flash-latest")
-    api_key = os.getenv("GOOGLE_API_KEY")
-    
-    llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.5, google_api_key=api_key)
-    
-    template = """
-    You are a Senior Security Engineer writing a formal Security Assessment Report.
-    
-    Based on the System Description and the identified risks provided below, generate the following sections in Markdown format: 
-    
-    # Security Assessment Report
-    
-    ## Executive Summary
-    (A high-level summary of the system and the critical findings)
-    
-    ## Introduction
-    (Brief introduction to the document and the system under review)
-    
-    ## Scope
-    (Define what was analyzed)
-    
-    ## Methodology
-    (Briefly explain that STRIDE threat modeling was used)
-    
-    ## Conclusion
-    (Final thoughts and next steps)
-    
-    Do NOT include the "Risk Assessment" table in this output; I will append it manually.
+    try:
+        assessment = RiskAssessment.model_validate(risks)
+    except ValidationError as e:
+        logger.warning(f"Risk assessment failed schema validation, attempting a fix: {e}")
+        
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content=STRIDE_SYSTEM_PROMPT),
+            ("human", RISK_FIX_PROMPT),
+        ])
+        chain = prompt | get_llm(0.3) | PydanticOutputParser(pydantic_object=RiskAssessment)
+        assessment = chain.invoke({"error": str(e), "completion": orjson.dumps(risks).decode()})
+        logger.info("Risk assessment output fixed successfully.")
     
-    System Description: {text}
-    Identified Risks Summary: {risks}
+    return [risk.model_dump(by_alias=True) for risk in assessment.root]
+
+class NarrativeStream:
+    """
+    Buffers narrative chunks produced by a background worker so the report page
+    can replay them with st.write_stream, from the start, on any rerun.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def append(self, chunk):
+        self.chunks.append(chunk)
+        self.started.set()
+
+    def finish(self):
+        # Also marks the stream started, so a reader waiting for a first chunk never hangs
+        self.started.set()
+        self.done.set()
+
+    def cancel(self):
+        """
+        Stops a narrative nobody will read: drops the job if it is still queued,
+        otherwise signals the worker to stop at its next chunk.
+        """
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+        self.finish()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            finished = self.done.is_set()
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if finished:
+                return
+            self.done.wait(0.05)
+
+def start_report_narrative(text_content, risks_data):
     """
+    Starts generating the report narrative in the background and returns its stream.
+    """
+    narrative_stream = NarrativeStream()
+    narrative_stream.future = get_executor().submit(
+        generate_report_narrative, text_content, risks_data, narrative_stream
+    )
+    return narrative_stream
+
+def clean_narrative(narrative):
+    """
+    Strips the Markdown code fences the model sometimes wraps the narrative in.
+    """
+    return narrative.replace("```markdown", "").replace("```", "").strip()
+
+def generate_report_narrative(text_content, risks_data, narrative_stream):
+    """
+    Generates the narrative sections of the report (Executive Summary, Intro, etc.),
+    appending tokens to narrative_stream as they arrive.
+    """
+    if narrative_stream.cancelled.is_set():
+        return
     
-    prompt = PromptTemplate.from_template(template)
-    chain = prompt | llm | StrOutputParser()
+    logger.info("Generating report narrative...")
     
+    # Everything runs inside the try: the worker's future is never read, so any
+    # exception must still end the stream or the report page waits forever.
     try:
-        response = chain.invoke({"text": text_content, "risks": str(risks_data)})
-        cleaned_response = response.replace("```markdown", "").replace("```", "").strip()
-
-        return cleaned_response
+        llm = get_llm(0.5)
+        
+        prompt = ChatPromptTemplate.from_messages([
+            SystemMessage(content=NARRATIVE_SYSTEM_PROMPT),
+            ("human", "System Description: {text}\nIdentified Risks: {risks}"),
+        ])
+        parser = StrOutputParser()
+        
+        # Compact JSON keeps the prompt small compared to the Python repr of the list
+        risks_json = orjson.dumps(risks_data).decode()
+        messages = prompt.invoke({"text": text_content, "risks": risks_json})
+        
+        if LLM_CACHE_PATH:
+            narrative_stream.append(parser.invoke(llm.invoke(messages)))
+        else:
+            # Stream from the model itself rather than a prompt | llm chain: closing a
+            # chain's stream drains the rest of the response, which defeats cancelling
+            with closing(llm.stream(messages)) as stream:
+                for chunk in stream:
+                    if narrative_stream.cancelled.is_set():
+                        logger.info("Report narrative generation cancelled.")
+                        return
+                    narrative_stream.append(parser.invoke(chunk))
+        logger.info("Report narrative generated successfully.")
     except Exception as e:
         logger.error(f"Error generating report narrative: {e}")
-        return "Error generating report narrative."
+        narrative_stream.append("\n\nError generating report narrative.")
+    finally:
+        narrative_stream.finish()
 
 # --- UI Implementation ---
 
-def main():
-    logger.info("Application starting...")
+# Static markup, built once at import instead of on every render
+CSS_BLOCK = """
+<style>
+    .stButton button.primary {
+        background-color: #007bff;
+        color: white;
+        border-color: #007bff;
+    }
+    .footer {
+        position: fixed;
+        left: 0;
+        bottom: 0;
+        width: 100%;
+        background-color: #f1f1f1;
+        color: #555;
+        text-align: center;
+        padding: 10px;
+        font-size: 14px;
+        z-index: 1000;
+    }
+    .main-header {
+        font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif;
+        color: #333;
+        font-weight: 700;
+        font-size: 2rem;
+        display: flex;
+        align-items: center;
+        gap: 10px;
+        margin-bottom: 30px;
+    }
+</style>
+"""
 
-    query_params = st.query_params
-    if "healthz" in query_params:
-        st.write("OK")
-        return
+HEADER_HTML = """
+<div class="main-header">
+    <span>🛡️</span> AI Security Risk Assessment
+</div>
+"""
 
+FOOTER_HTML = """
+<div class="footer">
+    ©2025 Rozul IO. All rights reserved
+</div>
+"""
+
+# Basic CSS for the PDF export; {body} receives the rendered report HTML
+PDF_HTML_TEMPLATE = """
+<html>
+<head>
+<style>
+    body {{ font-family: Helvetica, sans-serif; font-size: 12px; }}
+    h1 {{ color: #333; font-size: 24px; }}
+    h2 {{ color: #555; font-size: 18px; margin-top: 20px; }}
+    table {{ width: 100%; border-collapse: collapse; margin-top: 10px; }}
+    th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
+    th {{ background-color: #f2f2f2; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+def main():
     logger.info("Application starting...")
     
     # 1. Configuration
@@ -199,45 +565,19 @@ def main():
     )
 
     # 2. Custom CSS
-    st.markdown("""
-    <style>
-        .stButton button.primary {
-            background-color: #007bff;
-            color: white;
-            border-color: #007bff;
-        }
-        .footer {
-            position: fixed;
-            left: 0;
-            bottom: 0;
-            width: 100%;
-            background-color: #f1f1f1;
-            color: #555;
-            text-align: center;
-            padding: 10px;
-            font-size: 14px;
-            z-index: 1000;
-        }
-        .main-header {
-            font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif;
-            color: #333;
-            font-weight: 700;
-            font-size: 2rem;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            margin-bottom: 30px;
-        }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(CSS_BLOCK, unsafe_allow_html=True)
 
     # Initialize session state
     if 'page' not in st.session_state:
         st.session_state.page = 'home'
     if 'risk_data' not in st.session_state:
         st.session_state.risk_data = None
+    if 'risk_df' not in st.session_state:
+        st.session_state.risk_df = None
     if 'original_text' not in st.session_state:
         st.session_state.original_text = None
+    if 'narrative_stream' not in st.session_state:
+        st.session_state.narrative_stream = None
 
     # --- Page Routing ---
     if st.session_state.page == 'home':
@@ -247,11 +587,7 @@ def main():
 
 def render_home_page():
     # 3. Header
-    st.markdown("""
-        <div class="main-header">
-            <span>🛡️</span> AI Security Risk Assessment
-        </div>
-    """, unsafe_allow_html=True)
+    st.markdown(HEADER_HTML, unsafe_allow_html=True)
 
     # 4. Main Container
     uploaded_file = st.file_uploader("Upload your PRD/Spec", type=['docx'])
@@ -272,9 +608,23 @@ def render_home_page():
                         # Analyze and store in session state
                         risks = analyze_risk(content)
                         st.session_state.risk_data = risks
+                        # Build the DataFrame once here instead of on every rerun; the repetitive
+                        # columns are categorical so st.dataframe sends them dictionary-encoded
+                        st.session_state.risk_df = pd.DataFrame(risks, columns=RISK_COLUMNS).astype({
+                            "Threat Type": pd.CategoricalDtype(get_args(ThreatType)),
+                            "Risk Level": pd.CategoricalDtype(get_args(RiskLevel)),
+                        })
                         # Clear previous report if it exists
                         if 'full_report_md' in st.session_state:
                             del st.session_state.full_report_md
+                        # Start the narrative right away so it overlaps with the user reviewing the table
+                        # Cancel any narrative prefetched for a previous assessment
+                        if st.session_state.narrative_stream is not None:
+                            st.session_state.narrative_stream.cancel()
+                        st.session_state.narrative_stream = None
+                        if risks:
+                            logger.info("Prefetching report narrative in the background.")
+                            st.session_state.narrative_stream = start_report_narrative(content, risks)
                 except Exception as e:
                     st.error(f"An error occurred: {e}")
         else:
@@ -285,8 +635,7 @@ def render_home_page():
     if st.session_state.risk_data:
         st.success("Assessment Complete!")
         
-        # Convert to DataFrame
-        df = pd.DataFrame(st.session_state.risk_data)
+        df = st.session_state.risk_df
         
         # Display Table
         st.subheader("Risk Assessment Table")
@@ -309,11 +658,7 @@ def render_home_page():
                 st.rerun()
 
     # 6. Footer
-    st.markdown("""
-        <div class="footer">
-            ©2025 Rozul IO. All rights reserved
-        </div>
-    """, unsafe_allow_html=True)
+    st.markdown(FOOTER_HTML, unsafe_allow_html=True)
 
 def render_report_page():
     st.button("← Back to Assessment", on_click=lambda: st.session_state.update({'page': 'home'}), type="primary")
@@ -321,16 +666,28 @@ def render_report_page():
     if st.session_state.risk_data and st.session_state.original_text:
         # Check if report is already generated in session state
         if 'full_report_md' not in st.session_state or st.session_state.full_report_md is None:
+            # Use the narrative prefetched after the assessment, or start it now
+            if st.session_state.narrative_stream is None:
+                st.session_state.narrative_stream = start_report_narrative(
+                    st.session_state.original_text, st.session_state.risk_data
+                )
+            
+            # The prefetch may still be queued, so show progress until the first chunk
             with st.spinner("Generating narrative report..."):
-                # Generate narrative
-                narrative = generate_report_narrative(st.session_state.original_text, st.session_state.risk_data)
-                
-                # Construct the table Markdown
-                df = pd.DataFrame(st.session_state.risk_data)
-                table_md = df.to_markdown(index=False)
-                
-                # Combine
-                st.session_state.full_report_md = f"{narrative}\n\n## Risk Assessment\n\n{table_md}"
+                st.session_state.narrative_stream.started.wait()
+            
+            # Stream the narrative as it is generated, then replace it with the full report
+            placeholder = st.empty()
+            with placeholder.container():
+                narrative = st.write_stream(st.session_state.narrative_stream)
+            placeholder.empty()
+            narrative = clean_narrative(narrative or "")
+            
+            # Construct the table Markdown
+            table_md = _risks_to_md(st.session_state.risk_data)
+            
+            # Combine
+            st.session_state.full_report_md = f"{narrative}\n\n## Risk Assessment\n\n{table_md}"
         
         # Display the report
         st.markdown(st.session_state.full_report_md)
@@ -348,34 +705,26 @@ def render_report_page():
             )
         
         with col2:
-            # Convert MD to HTML for PDF
-            html_text = markdown.markdown(st.session_state.full_report_md, extensions=['tables'])
-            
-            # Add basic CSS for PDF
-            html_with_style = f"""
-            <html>
-            <head>
-            <style>
-                body {{ font-family: Helvetica, sans-serif; font-size: 12px; }}
-                h1 {{ color: #333; font-size: 24px; }}
-                h2 {{ color: #555; font-size: 18px; margin-top: 20px; }}
-                table {{ width: 100%; border-collapse: collapse; margin-top: 10px; }}
-                th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                th {{ background-color: #f2f2f2; }}
-            </style>
-            </head>
-            <body>
-            {html_text}
-            </body>
-            </html>
-            """
-            
-            pdf_bytes = convert_to_pdf(html_with_style)
+            # Render the PDF once per unique report; reruns (including the download click) reuse it
+            pdf_key = hashlib.blake2b(st.session_state.full_report_md.encode(), digest_size=16).hexdigest()
+            if st.session_state.get('pdf_key') != pdf_key:
+                # Convert MD to HTML for PDF
+                html_text = _md_to_html(st.session_state.full_report_md)
+                
+                # Add basic CSS for PDF
+                html_with_style = PDF_HTML_TEMPLATE.format(body=html_text)
+                
+                # Render in the background so the report stays interactive meanwhile
+                st.session_state.pdf_future = get_pdf_executor().submit(convert_to_pdf, html_with_style)
+                st.session_state.report_pdf = None
+                st.session_state.pdf_key = pdf_key
             
-            if pdf_bytes:
+            if st.session_state.get('pdf_future') is not None:
+                render_pdf_status()
+            elif st.session_state.report_pdf:
                 st.download_button(
                     label="Download Report (PDF)",
-                    data=pdf_bytes,
+                    data=st.session_state.report_pdf,
                     file_name='security_assessment_report.pdf',
                     mime='application/pdf',
                     type="primary"
@@ -385,5 +734,20 @@ def render_report_page():
     else:
         st.error("No data available. Please perform an assessment first.")
 
+@st.fragment(run_every=1)
+def render_pdf_status():
+    """
+    Polls the background PDF render and reruns the page once it has finished.
+    """
+    future = st.session_state.pdf_future
+    if not future.done():
+        st.button("Preparing PDF...", disabled=True, type="primary")
+        return
+    
+    # A failed render stores None, which the report page shows as an error
+    st.session_state.report_pdf = future.result()
+    st.session_state.pdf_future = None
+    st.rerun()
+
 if __name__ == "__main__":
     main()